@@ -46,26 +46,24 @@ class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
         B, H, T, Dh = query_layer.shape
         out = torch.zeros_like(query_layer)
 
-        mask_np = None
+        # 패딩 위치(마스크가 -10000 이하인 키/쿼리)는 payload에서 제외하고
+        # 유효 길이만 전송 -> 배치/패딩 입력에서도 결과가 올바름
+        valid_idx = [torch.arange(T)] * B
         if attention_mask is not None:
-            # 차원 축소 및 numpy 변환
             mask = attention_mask.squeeze(1).squeeze(1)
-            mask_np = mask.detach().cpu().numpy()
+            valid_idx = [torch.nonzero(m > -5000.0).flatten() for m in mask]
 
         for b in range(B):
+            idx = valid_idx[b]
             for h in range(H):
-                Q_np = query_layer[b, h].detach().cpu().numpy()
-                K_np = key_layer[b, h].detach().cpu().numpy()
-                V_np = value_layer[b, h].detach().cpu().numpy()
+                Q_np = query_layer[b, h, idx].detach().cpu().numpy()
+                K_np = key_layer[b, h, idx].detach().cpu().numpy()
+                V_np = value_layer[b, h, idx].detach().cpu().numpy()
 
                 # FPGA Attention 호출
-                if mask_np is not None:
-                    # 마스크 처리 로직이 필요하다면 여기에 추가 (현재는 그대로 전달)
-                    out_np = attention(Q_np, K_np, V_np, ser)
-                else:
-                    out_np = attention(Q_np, K_np, V_np, ser)
+                out_np = attention(Q_np, K_np, V_np, ser)
 
-                out[b, h] = torch.tensor(
+                out[b, h, idx] = torch.tensor(
                     out_np, dtype=query_layer.dtype, device=query_layer.device
                 )
 
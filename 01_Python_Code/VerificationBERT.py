@@ -1,12 +1,20 @@
 from typing import Optional, Tuple
+import json
+import sys
+import time
 import serial
 import torch
 import numpy as np
 import datasets
 from transformers import BertTokenizer, BertForSequenceClassification
 from transformers.models.bert.modeling_bert import BertSelfAttention
-from attention_approx import attention
-from softmax_batch import open_serial, close_serial
+from softmax_batch import open_serial, close_serial, length_mode, softmax_rows
+from emulator_pool import EmulatorPool
+from score_recorder import ScoreRecorder
+from softmax_emulator import EmulatedDevice
+from softmax_torch import TorchApproxSoftmax
+
+MASKED_SCORE = -10000.0
 
 
 class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
@@ -15,10 +23,20 @@ class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
         super().__init__(config, position_embedding_type=position_embedding_type)
         self.ser = None
         self.last_attn: Optional[np.ndarray] = None
+        self.recorder: Optional[ScoreRecorder] = None
+        self.layer_idx = 0
+        self.stats: Optional[dict] = None
 
     def set_serial(self, ser):
         self.ser = ser
 
+    def set_stats(self, stats: Optional[dict]):
+        self.stats = stats
+
+    def set_recorder(self, recorder: Optional[ScoreRecorder], layer_idx: int):
+        self.recorder = recorder
+        self.layer_idx = layer_idx
+
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -53,33 +71,69 @@ class BertSelfAttentionSoftmaxApprox(BertSelfAttention):
         value_layer = shape(mixed_value_layer)
 
         B, H, T, Dh = query_layer.shape
-        out = torch.zeros_like(query_layer)
 
-        mask_np = None
+        # Every head of every sequence in one score tensor. The additive
+        # mask is applied before quantization, as in BertSelfAttention, but
+        # fully masked keys (at or below MASKED_SCORE: finfo.min or -10000
+        # for [PAD]) are dropped from the payload rather than clipped to
+        # -32. With a per-key padding mask, [PAD] query rows are left out
+        # entirely (they come back as 0, and later layers mask them out as
+        # keys too), so each sequence is sent at its real length.
+        scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+        scores = scores / (Dh**0.5)
+        valid = None
+        row_mask = None
         if attention_mask is not None:
-            mask = attention_mask.squeeze(1).squeeze(1)
-            mask_np = mask.detach().cpu().numpy()
-
-        if output_attentions:
-            self.last_attn = np.zeros((B, H, T, T), dtype=np.float64)
+            scores = scores + attention_mask
+            valid = attention_mask > MASKED_SCORE / 2
+            row_mask = valid
+            if attention_mask.size(-2) == 1:
+                row_mask = valid & valid.transpose(-1, -2)
+        if self.recorder is not None:
+            self.recorder.record(scores, row_mask, layer=self.layer_idx)
+
+        # An in-graph kernel (softmax_torch.TorchApproxSoftmax) takes the
+        # whole score tensor; a port or emulator gets all B * H * T rows as
+        # one planned batch, written straight into probs_np.
+        kernel = getattr(self.ser, "softmax_tensor", None)
+        if kernel is not None:
+            probs = kernel(scores, valid)
+            probs_np = None
+            if output_attentions:
+                probs_np = probs.detach().cpu().double().numpy()
         else:
-            self.last_attn = None
+            probs_np = np.empty((B, H, T, T), dtype=np.float64)
+            st: dict = {}
+            t0 = time.perf_counter()
+            softmax_rows(
+                self.ser,
+                scores,
+                mask=row_mask,
+                out=probs_np,
+                pad_value=-32.0,
+                timeout_s=2.0,
+                stats=st,
+            )
+            if self.stats is not None:
+                add_softmax_stats(self.stats, st, time.perf_counter() - t0)
+            probs = torch.from_numpy(probs_np).to(
+                dtype=value_layer.dtype, device=value_layer.device
+            )
+        self.last_attn = probs_np if output_attentions else None
 
-        for b in range(B):
-            for h in range(H):
-                Q_np = query_layer[b, h].detach().cpu().numpy()
-                K_np = key_layer[b, h].detach().cpu().numpy()
-                V_np = value_layer[b, h].detach().cpu().numpy()
+        context_layer = torch.matmul(probs, value_layer)
+        context_layer = context_layer.transpose(1, 2).contiguous()
+        return context_layer.view(B, T, H * Dh), None
 
-                out_np = attention(
-                    Q_np, K_np, V_np, self.ser, pad_value=-32.0, timeout_s=2.0
-                )
-                out[b, h] = torch.tensor(
-                    out_np, dtype=query_layer.dtype, device=query_layer.device
-                )
 
-        context_layer = out.transpose(1, 2).contiguous().view(B, T, H * Dh)
-        return context_layer, None
+def add_softmax_stats(total: dict, st: dict, elapsed_s: float) -> None:
+    # Running totals over softmax_rows() calls; lanes_used / (frames * 64)
+    # is the share of the sent lanes that carried real scores.
+    for k in ("rows", "frames", "transactions", "retries"):
+        total[k] = total.get(k, 0) + st.get(k, 0)
+    used = st.get("lane_utilization", 0.0) * st.get("frames", 0) * 64
+    total["lanes_used"] = total.get("lanes_used", 0.0) + used
+    total["softmax_s"] = total.get("softmax_s", 0.0) + elapsed_s
 
 
 def replace_self_attention(model: BertForSequenceClassification, NewSAClass):
@@ -97,6 +151,22 @@ def set_serial_to_model(model: BertForSequenceClassification, ser):
             sa.set_serial(ser)
 
 
+def set_recorder_to_model(
+    model: BertForSequenceClassification, recorder: Optional[ScoreRecorder]
+):
+    for i, layer in enumerate(model.bert.encoder.layer):
+        sa = layer.attention.self
+        if hasattr(sa, "set_recorder"):
+            sa.set_recorder(recorder, i)
+
+
+def set_stats_to_model(model: BertForSequenceClassification, stats: Optional[dict]):
+    for layer in model.bert.encoder.layer:
+        sa = layer.attention.self
+        if hasattr(sa, "set_stats"):
+            sa.set_stats(stats)
+
+
 def get_last_attention_matrix(model, layer=0, head=0):
     L = len(model.bert.encoder.layer)
     layer = max(0, min(layer, L - 1))
@@ -137,8 +207,21 @@ def build_model_BERT(ser: serial.Serial):
     return tokenizer, baseline_model, approx_model, device
 
 
-def evaluate_SST2():
-    ser = open_serial("COM3", baud=115200, timeout=1.0)
+def open_backend(emulate: bool = False, torch_kernel: bool = False, workers: int = 1):
+    if torch_kernel:
+        return TorchApproxSoftmax()
+    if emulate:
+        return EmulatorPool(workers) if workers > 1 else EmulatedDevice()
+    return open_serial("COM3", baud=115200, timeout=1.0)
+
+
+def evaluate_SST2(
+    emulate: bool = False,
+    torch_kernel: bool = False,
+    workers: int = 1,
+    record_dir: Optional[str] = None,
+):
+    ser = open_backend(emulate, torch_kernel, workers)
     dataset = datasets.load_dataset("glue", "sst2", split="validation")
     tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
 
@@ -152,6 +235,8 @@ def evaluate_SST2():
     replace_self_attention(approx_model, BertSelfAttentionSoftmaxApprox)
 
     set_serial_to_model(approx_model, ser)
+    recorder = ScoreRecorder(record_dir) if record_dir else None
+    set_recorder_to_model(approx_model, recorder)
     correct_baseline = 0
     correct_approx = 0
     match_count_approx = 0
@@ -197,7 +282,145 @@ def evaluate_SST2():
         f"Prediction Match Rate   : {match_count_approx/total*100:.2f}% ({match_count_approx}/{total})"
     )
     close_serial(ser)
+    if recorder is not None:
+        recorder.close()
+        print(f"Recorded {recorder.stats['rows']} score rows to {record_dir}")
+
+
+def length_buckets(lengths: list[int], batch_size: int) -> list[tuple[int, list[int]]]:
+    # (mode, indices) batches of at most batch_size sentences that share a
+    # length mode (16/32/64-lane blocks, then 64-lane groups), longest first
+    # within each mode so padding inside a batch stays small.
+    modes = [length_mode(L) for L in lengths]
+    batches = []
+    for mode in sorted(set(modes)):
+        idx = [i for i in range(len(lengths)) if modes[i] == mode]
+        idx.sort(key=lambda i: -lengths[i])
+        for s in range(0, len(idx), batch_size):
+            batches.append((mode, idx[s : s + batch_size]))
+    return batches
+
+
+def evaluate_SST2_batched(
+    emulate: bool = False,
+    torch_kernel: bool = False,
+    workers: int = 1,
+    batch_size: int = 32,
+    out_path: str = "sst2_results.json",
+):
+    # Same comparison as evaluate_SST2(), but padded batches of sentences
+    # from one length bucket go through both models at once. Per-sentence
+    # predictions and the summary (accuracy, softmax rows/s, lane
+    # utilization on the wire) are written to out_path as JSON.
+    ser = open_backend(emulate, torch_kernel, workers)
+    dataset = datasets.load_dataset("glue", "sst2", split="validation")
+    tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
+
+    baseline_model = BertForSequenceClassification.from_pretrained(
+        "textattack/bert-base-uncased-SST-2"
+    ).eval()
+    approx_model = BertForSequenceClassification.from_pretrained(
+        "textattack/bert-base-uncased-SST-2"
+    ).eval()
+    replace_self_attention(approx_model, BertSelfAttentionSoftmaxApprox)
+    set_serial_to_model(approx_model, ser)
+    stats: dict = {}
+    set_stats_to_model(approx_model, stats)
+
+    sentences = dataset["sentence"]
+    labels = dataset["label"]
+    lengths = [
+        len(ids) for ids in tokenizer(sentences, truncation=True)["input_ids"]
+    ]
+
+    results = []
+    t_start = time.perf_counter()
+    for mode, idx in length_buckets(lengths, batch_size):
+        inputs = tokenizer(
+            [sentences[i] for i in idx],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+        )
+        with torch.no_grad():
+            pred_base = baseline_model(**inputs).logits.argmax(dim=-1).tolist()
+            pred_approx = approx_model(**inputs).logits.argmax(dim=-1).tolist()
+        for i, pb, pa in zip(idx, pred_base, pred_approx):
+            results.append(
+                {
+                    "idx": i,
+                    "length": lengths[i],
+                    "mode": mode,
+                    "label": labels[i],
+                    "base": pb,
+                    "approx": pa,
+                }
+            )
+        print(f"mode {mode:2d}  {len(idx):3d} sentences  L<={lengths[idx[0]]:3d}")
+    elapsed = time.perf_counter() - t_start
+    close_serial(ser)
+    results.sort(key=lambda r: r["idx"])
+
+    total = len(results)
+    lanes = stats.get("frames", 0) * 64
+    summary = {
+        "sentences": total,
+        "batch_size": batch_size,
+        "base_accuracy": sum(r["base"] == r["label"] for r in results) / total,
+        "approx_accuracy": sum(r["approx"] == r["label"] for r in results) / total,
+        "match_rate": sum(r["base"] == r["approx"] for r in results) / total,
+        "elapsed_s": elapsed,
+        "sentences_per_s": total / elapsed,
+        "softmax_rows": stats.get("rows", 0),
+        "softmax_s": stats.get("softmax_s", 0.0),
+        "rows_per_s": (
+            stats["rows"] / stats["softmax_s"] if stats.get("softmax_s") else 0.0
+        ),
+        "frames": stats.get("frames", 0),
+        "transactions": stats.get("transactions", 0),
+        "retries": stats.get("retries", 0),
+        "lane_utilization": stats["lanes_used"] / lanes if lanes else 0.0,
+    }
+    with open(out_path, "w") as f:
+        json.dump({"summary": summary, "results": results}, f, indent=1)
+
+    print("\nEvaluation Results :")
+    print(f"Baseline BERT Accuracy : {summary['base_accuracy'] * 100:.2f}%")
+    print(f"Approx BERT Accuracy   : {summary['approx_accuracy'] * 100:.2f}%")
+    print(f"Prediction Match Rate  : {summary['match_rate'] * 100:.2f}%")
+    print(
+        f"Softmax offload        : {summary['rows_per_s']:.0f} rows/s, "
+        f"{summary['lane_utilization'] * 100:.1f}% lane utilization, "
+        f"{summary['transactions']} transactions"
+    )
+    print(f"Results written to {out_path}")
 
 
 if __name__ == "__main__":
-    evaluate_SST2()
+    workers = 1
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    record_dir = None
+    if "--record" in sys.argv:
+        record_dir = sys.argv[sys.argv.index("--record") + 1]
+    if "--batched" in sys.argv:
+        batch_size = 32
+        if "--batch-size" in sys.argv:
+            batch_size = int(sys.argv[sys.argv.index("--batch-size") + 1])
+        out_path = "sst2_results.json"
+        if "--out" in sys.argv:
+            out_path = sys.argv[sys.argv.index("--out") + 1]
+        evaluate_SST2_batched(
+            emulate="--emulate" in sys.argv,
+            torch_kernel="--torch" in sys.argv,
+            workers=workers,
+            batch_size=batch_size,
+            out_path=out_path,
+        )
+    else:
+        evaluate_SST2(
+            emulate="--emulate" in sys.argv,
+            torch_kernel="--torch" in sys.argv,
+            workers=workers,
+            record_dir=record_dir,
+        )
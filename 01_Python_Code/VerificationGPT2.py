@@ -1,11 +1,16 @@
 import torch
 import numpy as np
 import serial
+import sys
 import time
 from typing import Optional, Tuple
 from transformers import GPT2Tokenizer, GPT2LMHeadModel
 from transformers.models.gpt2.modeling_gpt2 import GPT2Attention
-from softmax_batch import open_serial, close_serial, softmax_batch
+from softmax_batch import open_serial, close_serial, softmax_rows
+from micro_batcher import SoftmaxMicroBatcher
+from score_recorder import ScoreRecorder
+from softmax_emulator import EmulatedDevice
+from softmax_torch import TorchApproxSoftmax
 
 
 SERIAL_PORT = "COM3"
@@ -17,10 +22,14 @@ class GPT2AttentionSoftmaxApprox(GPT2Attention):
     def __init__(self, config, is_cross_attention=False, layer_idx=None):
         super().__init__(config, is_cross_attention, layer_idx)
         self.ser = None
+        self.recorder: Optional[ScoreRecorder] = None
 
     def set_serial(self, ser):
         self.ser = ser
 
+    def set_recorder(self, recorder: Optional[ScoreRecorder]):
+        self.recorder = recorder
+
     def _my_split_heads(self, tensor, num_heads, attn_head_size):
         new_shape = tensor.size()[:-1] + (num_heads, attn_head_size)
         tensor = tensor.view(new_shape)
@@ -74,23 +83,49 @@ class GPT2AttentionSoftmaxApprox(GPT2Attention):
             attn_weights = attn_weights + attention_mask
 
         B, H, Tq, Tk = attn_weights.shape
-        attn_weights_cpu = attn_weights.detach().cpu().numpy()
-
-        attn_probs = torch.zeros_like(attn_weights)
-
-        for b in range(B):
-            for h in range(H):
-                matrix = attn_weights_cpu[b, h]
-                rows_list = [matrix[i, :] for i in range(Tq)]
-
-                probs_list = softmax_batch(
-                    self.ser, rows_list, pad_value=-32.0, timeout_s=5.0
-                )
 
-                probs_matrix = np.vstack(probs_list)
-                attn_probs[b, h] = torch.tensor(
-                    probs_matrix, dtype=attn_weights.dtype, device=attn_weights.device
-                )
+        # Query row i only sees keys [0, Tk - Tq + i]; the causal mask drops
+        # the future keys from the payload so early rows use the packed
+        # modes, and they come back as 0.
+        causal_np = causal_mask.bool().cpu().numpy()
+        if self.recorder is not None:
+            self.recorder.record(attn_weights, causal_np, layer=self.layer_idx)
+
+        # An in-graph kernel (softmax_torch.TorchApproxSoftmax) and a plain
+        # port both take the whole tensor in one call; a SoftmaxMicroBatcher
+        # takes every head at once and coalesces them into shared
+        # transactions.
+        kernel = getattr(self.ser, "softmax_tensor", None)
+        submit = getattr(self.ser, "submit", None)
+        if kernel is not None:
+            attn_probs = kernel(attn_weights, causal_mask.bool())
+        elif submit is None:
+            probs_np = softmax_rows(
+                self.ser,
+                attn_weights,
+                mask=causal_np,
+                pad_value=-32.0,
+                timeout_s=5.0,
+            )
+        else:
+            attn_weights_cpu = attn_weights.detach().cpu().numpy()
+            causal_lens = causal_np[0, 0].sum(axis=-1).tolist()
+            pending = []
+            for b in range(B):
+                for h in range(H):
+                    matrix = attn_weights_cpu[b, h]
+                    rows_list = [matrix[i, : causal_lens[i]] for i in range(Tq)]
+                    pending.append((b, h, submit(rows_list)))
+
+            probs_np = np.zeros((B, H, Tq, Tk), dtype=np.float64)
+            for b, h, fut in pending:
+                for i, p in enumerate(fut.result()):
+                    probs_np[b, h, i, : causal_lens[i]] = p
+
+        if kernel is None:
+            attn_probs = torch.tensor(
+                probs_np, dtype=attn_weights.dtype, device=attn_weights.device
+            )
 
         attn_probs = self.attn_dropout(attn_probs)
 
@@ -123,6 +158,12 @@ def replace_gpt2_attention(model: GPT2LMHeadModel, ser_instance):
     print(f"Replaced {count} attention layers with Hardware-Approximated version.")
 
 
+def set_gpt2_recorder(model: GPT2LMHeadModel, recorder: Optional[ScoreRecorder]):
+    for layer in model.transformer.h:
+        if hasattr(layer.attn, "set_recorder"):
+            layer.attn.set_recorder(recorder)
+
+
 def build_model_GPT2(ser: serial.Serial):
     device = "cpu"
     model_name = "gpt2"
@@ -137,8 +178,23 @@ def build_model_GPT2(ser: serial.Serial):
     return tokenizer, base_model, approx_model, device
 
 
-def run_interactive_verification():
-    ser = open_serial(SERIAL_PORT, baud=BAUD_RATE, timeout=1.0)
+def run_interactive_verification(
+    emulate: bool = False,
+    torch_kernel: bool = False,
+    record_dir: Optional[str] = None,
+    micro_batch: bool = False,
+):
+    if torch_kernel:
+        ser = TorchApproxSoftmax()
+    elif emulate:
+        ser = EmulatedDevice()
+    else:
+        ser = open_serial(SERIAL_PORT, baud=BAUD_RATE, timeout=1.0)
+    # Heads of a layer are submitted together and coalesced into shared
+    # transactions; the in-graph kernel has no port to share.
+    port = ser
+    if micro_batch and not torch_kernel:
+        ser = SoftmaxMicroBatcher(port)
     device = "cpu"
     model_name = "gpt2"
 
@@ -149,6 +205,8 @@ def run_interactive_verification():
     baseline_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
     approx_model = GPT2LMHeadModel.from_pretrained(model_name).to(device).eval()
     replace_gpt2_attention(approx_model, ser)
+    recorder = ScoreRecorder(record_dir) if record_dir else None
+    set_gpt2_recorder(approx_model, recorder)
 
     while True:
         try:
@@ -200,8 +258,21 @@ def run_interactive_verification():
         except Exception as e:
             print(f"\nAn error occurred: {e}")
     close_serial(ser)
+    if port is not ser:
+        close_serial(port)
     print("Serial port closed.")
+    if recorder is not None:
+        recorder.close()
+        print(f"Recorded {recorder.stats['rows']} score rows to {record_dir}")
 
 
 if __name__ == "__main__":
-    run_interactive_verification()
+    record_dir = None
+    if "--record" in sys.argv:
+        record_dir = sys.argv[sys.argv.index("--record") + 1]
+    run_interactive_verification(
+        emulate="--emulate" in sys.argv,
+        torch_kernel="--torch" in sys.argv,
+        record_dir=record_dir,
+        micro_batch="--micro-batch" in sys.argv,
+    )
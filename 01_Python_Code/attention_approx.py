@@ -1,6 +1,7 @@
 import numpy as np
 import serial
-from softmax_batch import softmax_batch
+from typing import Optional
+from softmax_batch import as_float32, softmax_batch_iter
 
 
 def attention(
@@ -11,6 +12,8 @@ def attention(
     *,
     pad_value: float = -32.0,
     timeout_s: float = 10.0,
+    topk: Optional[int] = None,
+    stats: Optional[dict] = None,
 ) -> np.ndarray:
 
     Q = np.asarray(Q, dtype=np.float64)
@@ -31,20 +34,20 @@ def attention(
 
     d_k = d_kq
 
-    S = (K @ Q.T) / np.sqrt(d_k)
+    # Scores in float64; only the finished matrix is cast to float32 for
+    # the encoder.
+    S = as_float32(((K @ Q.T) / np.sqrt(d_k)).T)
 
-    seqs = [S[:, j].astype(np.float32, copy=False) for j in range(Nq)]
-
-    probs_list = softmax_batch(
+    # Multiply each transaction's rows with V as they come back, while the
+    # remaining rows are still on the wire.
+    out = np.empty((Nq, d_v), dtype=np.float64)
+    for rows, probs in softmax_batch_iter(
         ser,
-        seqs,
+        S,
         pad_value=pad_value,
         timeout_s=timeout_s,
-    )
-
-    P = np.vstack([np.asarray(p, dtype=np.float64) for p in probs_list])
-    if P.shape != (Nq, Nk):
-        raise RuntimeError(f"softmax_batch returned {P.shape}, expected {(Nq, Nk)}")
-
-    out = P @ V
+        topk=topk,
+        stats=stats,
+    ):
+        out[rows] = np.stack(probs) @ V
     return out
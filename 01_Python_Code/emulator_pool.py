@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from softmax_batch import BYTES_PER_ROW
+from softmax_emulator import EmulatedDevice, group_spans
+
+# Process-parallel EmulatedDevice for dataset-scale offline runs. Batches go
+# through shared memory: the parent copies the 129-byte rows in once, each
+# worker emulates a contiguous slice in place, and the parent copies the
+# result rows out. Slices are cut only where the group counter is idle, so
+# every worker sees whole (mode - 1)-frame groups.
+
+MIN_FRAMES_PER_WORKER = 2048
+
+
+def _emulate_slice(in_name: str, out_name: str, n: int, start: int, stop: int) -> int:
+    # Pool workers share the parent's resource tracker, which unlinks the
+    # segments if the parent dies mid-batch.
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        src = np.ndarray((n, BYTES_PER_ROW), dtype=np.uint8, buffer=shm_in.buf)
+        dst = np.ndarray((n, BYTES_PER_ROW), dtype=np.uint8, buffer=shm_out.buf)
+        dst[start:stop] = EmulatedDevice().transact(src[start:stop])
+        del src, dst
+    finally:
+        shm_in.close()
+        shm_out.close()
+    return stop - start
+
+
+def split_points(modes: np.ndarray, parts: int) -> list[int]:
+    # Boundaries 0 = b0 < ... < bk = N that never fall inside a run of
+    # group-mode frames: a cut is allowed after a frame that is not in
+    # modes 3..13 or that closes a group.
+    modes = np.asarray(modes, dtype=np.int64) & 0x0F
+    n = modes.size
+    if parts <= 1 or n == 0:
+        return [0, n]
+    safe = np.zeros(n + 1, dtype=bool)
+    safe[1:] = (modes < 3) | (modes > 13)
+    safe[[e for _, e in group_spans(modes)]] = True
+    safe[n] = True
+    ok = np.flatnonzero(safe)
+    cuts = ok[np.searchsorted(ok, np.arange(1, parts) * n // parts)]
+    return [0] + sorted(set(cuts.tolist()) - {0, n}) + [n]
+
+
+class EmulatorPool:
+    # Same transact() interface as EmulatedDevice; batches smaller than
+    # workers * min_frames_per_worker run inline.
+
+    is_open = True
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        *,
+        min_frames_per_worker: int = MIN_FRAMES_PER_WORKER,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_frames_per_worker = min_frames_per_worker
+        self.frames = 0
+        self.transactions = 0
+        self._inline = EmulatedDevice()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def transact(self, frames_u8: np.ndarray) -> np.ndarray:
+        frames_u8 = np.asarray(frames_u8, dtype=np.uint8)
+        if frames_u8.ndim != 2 or frames_u8.shape[1] != BYTES_PER_ROW:
+            raise ValueError(f"frames must be shape (N, {BYTES_PER_ROW})")
+        n = frames_u8.shape[0]
+        parts = min(self.workers, n // self.min_frames_per_worker)
+        self.frames += n
+        self.transactions += 1
+        if self._pool is None or parts <= 1:
+            return self._inline.transact(frames_u8)
+
+        bounds = split_points(frames_u8[:, 0], parts)
+        shm_in = shared_memory.SharedMemory(create=True, size=frames_u8.nbytes)
+        shm_out = shared_memory.SharedMemory(create=True, size=frames_u8.nbytes)
+        try:
+            src = np.ndarray(frames_u8.shape, dtype=np.uint8, buffer=shm_in.buf)
+            src[...] = frames_u8
+            futures = [
+                self._pool.submit(_emulate_slice, shm_in.name, shm_out.name, n, a, b)
+                for a, b in zip(bounds[:-1], bounds[1:])
+            ]
+            for f in futures:
+                f.result()
+            out = np.ndarray(frames_u8.shape, dtype=np.uint8, buffer=shm_out.buf).copy()
+            del src
+        finally:
+            for shm in (shm_in, shm_out):
+                shm.close()
+                shm.unlink()
+        return out
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        self.is_open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(
+    n_frames: int = 1 << 18,
+    workers: Optional[list[int]] = None,
+    repeats: int = 3,
+    seed: int = 0,
+) -> dict[int, float]:
+    # Frames per second of transact() on random Q6.10 frames with a mix of
+    # block and group modes, best of `repeats`, per worker count.
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 256, (n_frames, BYTES_PER_ROW), dtype=np.uint8)
+    frames[:, 0] = rng.choice([0, 1, 2, 2, 5], n_frames)
+    workers = workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    rates = {}
+    for w in workers:
+        with EmulatorPool(w, min_frames_per_worker=1) as pool:
+            pool.transact(frames[: w * 64])
+            best = float("inf")
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                pool.transact(frames)
+                best = min(best, time.perf_counter() - t0)
+        rates[w] = n_frames / best
+    return rates
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1 << 18
+    rates = benchmark(n)
+    base = rates[min(rates)]
+    for w, r in rates.items():
+        print(f"workers={w:<3d} {r:12.0f} frames/s  x{r / base:.2f}")
@@ -0,0 +1,119 @@
+import argparse
+import time
+
+import numpy as np
+import serial
+
+from softmax_batch import BYTES_PER_ROW, resync, transact_rows
+from softmax_emulator import EmulatedDevice
+from timing_model import TimingModel
+from virtual_fpga import FaultProfile, VirtualFPGA
+
+# Throughput and tail latency of the host recovery path (transact_rows():
+# reply checks, resync, resend) against a VirtualFPGA injecting each fault
+# profile. Replies are compared with the emulator, so faults that slip
+# past the checks show up as corrupt rows.
+
+PROFILES = {
+    "clean": FaultProfile(),
+    "drop": FaultProfile(drop_rate=2e-5),
+    "dup": FaultProfile(dup_rate=2e-5),
+    "delay": FaultProfile(delay_rate=0.05, delay_s=0.05),
+    "stuck": FaultProfile(stuck_rate=0.02, stuck_s=0.05),
+}
+
+
+def run_profile(
+    faults: FaultProfile,
+    *,
+    transactions: int = 200,
+    rows_per_tx: int = 32,
+    baud: int = 921600,
+    retries: int = 3,
+    seed: int = 0,
+) -> dict:
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 256, (transactions * rows_per_tx, BYTES_PER_ROW), np.uint8)
+    frames[:, 0] = rng.choice([0, 1, 2], frames.shape[0])
+    expected = EmulatedDevice().transact(frames)
+
+    model_s = TimingModel.for_baud(baud).transaction_seconds(rows_per_tx)
+    timeout_s = 2 * model_s + 0.05
+    stats: dict = {}
+    lat = []
+    failed = corrupt = 0
+    with VirtualFPGA(baud=baud, faults=faults, seed=seed) as dev:
+        ser = serial.Serial(dev.port, baud, timeout=timeout_s)
+        t_start = time.perf_counter()
+        for t in range(transactions):
+            idx = slice(t * rows_per_tx, (t + 1) * rows_per_tx)
+            t0 = time.perf_counter()
+            try:
+                rows = transact_rows(
+                    ser,
+                    rows_per_tx - 1,
+                    [r.tobytes() for r in frames[idx]],
+                    timeout_s=timeout_s,
+                    retries=retries,
+                    stats=stats,
+                )
+            except (TimeoutError, RuntimeError):
+                failed += 1
+                resync(ser, timeout_s=timeout_s)
+                continue
+            lat.append(time.perf_counter() - t0)
+            got = np.frombuffer(b"".join(rows), np.uint8).reshape(-1, BYTES_PER_ROW)
+            corrupt += int((got != expected[idx]).any(axis=1).sum())
+        elapsed = time.perf_counter() - t_start
+        ser.close()
+        injected = {
+            k: dev.stats[k] for k in ("dropped", "duplicated", "delayed", "stuck")
+        }
+
+    lat = np.array(lat)
+    ok_rows = lat.size * rows_per_tx
+    return {
+        "rows_per_s": ok_rows / elapsed,
+        "model_rows_per_s": rows_per_tx / model_s,
+        "p50_ms": float(np.percentile(lat, 50)) * 1e3 if lat.size else float("nan"),
+        "p99_ms": float(np.percentile(lat, 99)) * 1e3 if lat.size else float("nan"),
+        "max_ms": float(lat.max()) * 1e3 if lat.size else float("nan"),
+        "retries": stats.get("retries", 0),
+        "filler_bytes": stats.get("filler_bytes", 0),
+        "failed_tx": failed,
+        "corrupt_rows": corrupt,
+        **injected,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recovery-path benchmark.")
+    ap.add_argument("--transactions", type=int, default=200)
+    ap.add_argument("--rows", type=int, default=32, help="rows per transaction")
+    ap.add_argument("--baud", type=int, default=921600)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--profiles", nargs="*", default=list(PROFILES))
+    args = ap.parse_args()
+
+    clean = None
+    for name in args.profiles:
+        r = run_profile(
+            PROFILES[name],
+            transactions=args.transactions,
+            rows_per_tx=args.rows,
+            baud=args.baud,
+            retries=args.retries,
+        )
+        clean = clean or r["rows_per_s"]
+        print(
+            f"{name:<6} {r['rows_per_s']:8.0f} rows/s ({r['rows_per_s'] / clean:5.1%})"
+            f"  p50 {r['p50_ms']:6.1f} ms  p99 {r['p99_ms']:7.1f} ms"
+            f"  max {r['max_ms']:7.1f} ms  retries {r['retries']:3d}"
+            f"  failed {r['failed_tx']}  corrupt {r['corrupt_rows']}"
+            f"  injected d{r['dropped']}/u{r['duplicated']}"
+            f"/l{r['delayed']}/s{r['stuck']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
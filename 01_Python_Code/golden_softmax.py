@@ -0,0 +1,129 @@
+import argparse
+from typing import Optional
+
+import numpy as np
+
+from softmax_batch import SCALE, quantize_q6_10
+from softmax_emulator import block_reduce, group_spans
+
+# Exact (float64) softmax references for hardware regression runs, in the
+# same grouping the device uses: 16/32/64-lane blocks for modes 0..2 and
+# (mode - 1)-frame groups for modes 3..13. Replaces the per-row loops of
+# 04_Python_Code/softmax_golden.py.
+
+GOLDEN_BLOCK = 1 << 16
+
+
+def golden_frames(x, modes, *, block: int = GOLDEN_BLOCK) -> np.ndarray:
+    # x: (N, 64) frames, int16 Q6.10 raw or floats; modes: (N,) headers.
+    x = np.asarray(x)
+    if x.ndim != 2 or x.shape[1] != 64:
+        raise ValueError("x must be shape (N, 64)")
+    modes = np.asarray(modes, dtype=np.int64) & 0x0F
+    if modes.shape != (x.shape[0],):
+        raise ValueError("modes must be shape (N,)")
+    if np.issubdtype(x.dtype, np.integer):
+        x = x.astype(np.float64) / SCALE
+    else:
+        x = x.astype(np.float64)
+
+    spans = np.array(group_spans(modes), dtype=np.int64).reshape(-1, 2)
+    out = np.empty_like(x)
+    s = 0
+    while s < x.shape[0]:
+        e = min(x.shape[0], s + block)
+        # Never cut through a group.
+        k = np.searchsorted(spans[:, 0], e, side="left") - 1
+        if k >= 0 and spans[k, 1] > e:
+            e = int(spans[k, 1])
+        sel = spans[(spans[:, 0] >= s) & (spans[:, 1] <= e)] - s
+        blk = x[s:e]
+        m = modes[s:e]
+        sp = [tuple(p) for p in sel.tolist()]
+        ex = np.exp(blk - block_reduce(blk, m, sp, np.maximum))
+        out[s:e] = ex / block_reduce(ex, m, sp, np.add)
+        s = e
+    return out
+
+
+def golden_rows(
+    scores,
+    lengths: Optional[np.ndarray] = None,
+    *,
+    quantize: bool = True,
+    block: int = GOLDEN_BLOCK,
+) -> np.ndarray:
+    # (N, L) rows, each over its first lengths[i] entries (all L by
+    # default); entries past the length are 0. Integer input is taken as
+    # raw Q6.10; float input is first rounded to Q6.10 as the host encoder
+    # does, unless quantize is off.
+    x = np.asarray(scores)
+    if x.ndim != 2:
+        raise ValueError("scores must be shape (N, L)")
+    N, L = x.shape
+    if lengths is None:
+        lengths = np.full(N, L, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if lengths.shape != (N,) or (N and (lengths.min() < 1 or lengths.max() > L)):
+        raise ValueError(f"lengths must be shape ({N},) with values 1..{L}")
+
+    out = np.zeros((N, L), dtype=np.float64)
+    cols = np.arange(L)
+    step = max(1, block // max(1, L))
+    for s in range(0, N, step):
+        blk = x[s : s + step]
+        if np.issubdtype(blk.dtype, np.integer):
+            blk = blk.astype(np.float64) / SCALE
+        elif quantize:
+            blk = quantize_q6_10(blk).astype(np.float64) / SCALE
+        else:
+            blk = blk.astype(np.float64)
+        valid = cols < lengths[s : s + step, None]
+        blk = np.where(valid, blk, -np.inf)
+        ex = np.exp(blk - blk.max(axis=1, keepdims=True))
+        out[s : s + step] = ex / ex.sum(axis=1, keepdims=True)
+    return out
+
+
+def write_comp_txt(path: str, probs: np.ndarray, per_line: int = 8) -> None:
+    # Same layout as comp.txt: "%.6f " values, 8 per line, a blank line
+    # between rows.
+    probs = np.asarray(probs, dtype=np.float64)
+    L = probs.shape[1]
+    fmt = " ".join(["%.6f"] * per_line) + " "
+    with open(path, "w") as f:
+        for i, row in enumerate(probs):
+            if i:
+                f.write("\n")
+            full = L - L % per_line
+            np.savetxt(f, row[:full].reshape(-1, per_line), fmt=fmt)
+            if full < L:
+                f.write(" ".join(f"{v:.6f}" for v in row[full:]) + " \n")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Golden softmax for regression runs.")
+    ap.add_argument("input", help=".npy corpus: (N, 64) frames or (N, L) rows")
+    ap.add_argument("-o", "--output", required=True, help="output .npy")
+    ap.add_argument("--modes", help=".npy (N,) mode headers; treats input as frames")
+    ap.add_argument("--lengths", help=".npy (N,) valid lengths for (N, L) rows")
+    ap.add_argument("--txt", help="also write comp.txt-style text here")
+    ap.add_argument("--float32", action="store_true", help="store float32")
+    args = ap.parse_args()
+
+    x = np.load(args.input, mmap_mode="r")
+    if args.modes:
+        probs = golden_frames(x, np.load(args.modes))
+    else:
+        lengths = np.load(args.lengths) if args.lengths else None
+        probs = golden_rows(x, lengths)
+    if args.float32:
+        probs = probs.astype(np.float32)
+    np.save(args.output, probs)
+    if args.txt:
+        write_comp_txt(args.txt, probs)
+    print(f"{probs.shape[0]} rows -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
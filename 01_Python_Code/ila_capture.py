@@ -0,0 +1,203 @@
+import argparse
+import csv
+import os
+import re
+from typing import Iterator, Optional
+
+import numpy as np
+
+from timing_model import PIPELINE_CYCLES
+
+# Decoder for Vivado ILA exports (05_Result/iladata.csv): a header row of
+# probe names ("o_dina[1027:0]"), a radix row, then one row per sample.
+# Rows are read in chunks and decoded column-wise; 1024/1028-bit buses
+# become (N, 64) int16 lanes in o_prob_flat order (lane 0 = bits 15:0),
+# with the bits above 1024 (the length mode of i_doutb) split out as
+# "<name>_mode".
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ILA_CSV = os.path.join(ROOT, "00_Softmax_Approx_with_Tree", "05_Result", "iladata.csv")
+
+LANES = 64
+LANE_BITS = 16
+CHUNK_ROWS = 4096
+
+_HEX = np.full(256, 0xFF, dtype=np.uint8)
+for _i, _c in enumerate("0123456789abcdef"):
+    _HEX[ord(_c)] = _i
+    _HEX[ord(_c.upper())] = _i
+
+
+def parse_probe(name: str) -> tuple[str, int]:
+    # "o_addra[4:0]" -> ("o_addra", 5); plain names are 1 bit wide.
+    m = re.fullmatch(r"(.*?)\[(\d+):(\d+)\]", name.strip())
+    if m is None:
+        return name.strip(), 1
+    return m.group(1), int(m.group(2)) - int(m.group(3)) + 1
+
+
+def _nibbles(values: list[str], width: int) -> np.ndarray:
+    buf = "".join(v.rjust(width, "0") for v in values).encode("ascii")
+    if len(buf) != len(values) * width:
+        raise ValueError(f"hex value wider than {width} digits")
+    nib = _HEX[np.frombuffer(buf, dtype=np.uint8)].reshape(len(values), width)
+    if (nib == 0xFF).any():
+        raise ValueError("non-hex digit in ILA capture (X/Z samples?)")
+    return nib
+
+
+def decode_bus(values: list[str], bits: int) -> tuple[np.ndarray, Optional[np.ndarray]]:
+    # Hex strings of a >= 1024-bit bus -> ((N, 64) int16 lanes, top bits or
+    # None).
+    width = (bits + 3) // 4
+    nib = _nibbles(values, width).astype(np.uint16)
+    body = nib[:, width - LANES * 4 :].reshape(-1, LANES, 4)
+    words = (
+        (body[..., 0] << 12) | (body[..., 1] << 8) | (body[..., 2] << 4) | body[..., 3]
+    )
+    lanes = np.ascontiguousarray(words[:, ::-1]).view(np.int16)
+    top = None
+    if bits > LANES * LANE_BITS:
+        top = np.zeros(len(values), dtype=np.uint8)
+        for k in range(width - LANES * 4):
+            top = (top << 4) | nib[:, k].astype(np.uint8)
+    return lanes, top
+
+
+def decode_scalar(values: list[str], radix: str, bits: int) -> np.ndarray:
+    if radix == "HEX":
+        nib = _nibbles(values, (bits + 3) // 4).astype(np.int64)
+        out = np.zeros(len(values), dtype=np.int64)
+        for k in range(nib.shape[1]):
+            out = (out << 4) | nib[:, k]
+        return out
+    if radix == "BINARY":
+        return np.array([int(v, 2) for v in values], dtype=np.int64)
+    return np.array(values, dtype=np.int64)
+
+
+def iter_ila(
+    path: str = ILA_CSV,
+    *,
+    columns: Optional[list[str]] = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[dict[str, np.ndarray]]:
+    # Yields dicts of column arrays, chunk_rows samples at a time. columns
+    # restricts decoding to the named probes (base names, no bit range).
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        radix = next(reader)
+        radix[0] = radix[0].replace("Radix - ", "")
+        probes = [parse_probe(h) for h in header]
+        wanted = [
+            i
+            for i, (name, _) in enumerate(probes)
+            if columns is None or name in columns
+        ]
+        if columns is not None:
+            missing = set(columns) - {probes[i][0] for i in wanted}
+            if missing:
+                raise ValueError(f"probes not in capture: {sorted(missing)}")
+
+        while True:
+            rows = [r for _, r in zip(range(chunk_rows), reader) if r]
+            if not rows:
+                return
+            chunk = {}
+            for i in wanted:
+                name, bits = probes[i]
+                values = [r[i] for r in rows]
+                if bits >= LANES * LANE_BITS:
+                    chunk[name], top = decode_bus(values, bits)
+                    if top is not None:
+                        chunk[name + "_mode"] = top
+                else:
+                    chunk[name] = decode_scalar(values, radix[i].strip(), bits)
+            yield chunk
+
+
+def load_ila(
+    path: str = ILA_CSV, *, columns: Optional[list[str]] = None
+) -> dict[str, np.ndarray]:
+    parts: dict[str, list[np.ndarray]] = {}
+    for chunk in iter_ila(path, columns=columns):
+        for k, v in chunk.items():
+            parts.setdefault(k, []).append(v)
+    return {k: np.concatenate(v) for k, v in parts.items()}
+
+
+def valid_latency(
+    window: np.ndarray, valid_in: np.ndarray, valid_out: np.ndarray
+) -> np.ndarray:
+    # Per-row pipeline latency in samples. The core is in-order, so within a
+    # capture window the k-th cycle with o_valid (frame into softmax_approx)
+    # pairs with the k-th cycle with i_valid (result out). Results seen
+    # before the first input of a window belong to frames sent before the
+    # trigger and are dropped, as are inputs whose result is not captured.
+    window = np.asarray(window)
+    lat = []
+    for w in np.unique(window):
+        idx = np.flatnonzero(window == w)
+        t_in = idx[np.asarray(valid_in)[idx] != 0]
+        t_out = idx[np.asarray(valid_out)[idx] != 0]
+        if t_in.size:
+            t_out = t_out[t_out > t_in[0]]
+        n = min(t_in.size, t_out.size)
+        lat.append(t_out[:n] - t_in[:n])
+    return np.concatenate(lat) if lat else np.zeros(0, dtype=np.int64)
+
+
+def measure_latency(
+    path: str = ILA_CSV,
+    *,
+    valid_in: str = "o_valid",
+    valid_out: str = "i_valid",
+) -> dict:
+    # Streams only the narrow probes; the ILA samples on i_clk, so one
+    # sample is one core clock.
+    cols = ["Sample in Window", valid_in, valid_out]
+    win, vin, vout = [], [], []
+    window_id = -1
+    for chunk in iter_ila(path, columns=cols):
+        starts = chunk["Sample in Window"] == 0
+        ids = window_id + np.cumsum(starts)
+        window_id = int(ids[-1])
+        win.append(ids)
+        vin.append(chunk[valid_in])
+        vout.append(chunk[valid_out])
+    lat = valid_latency(np.concatenate(win), np.concatenate(vin), np.concatenate(vout))
+
+    rep = {
+        "windows": window_id + 1,
+        "rows": int(lat.size),
+        "expected_cycles": PIPELINE_CYCLES,
+    }
+    if lat.size:
+        rep.update(
+            min_cycles=int(lat.min()),
+            max_cycles=int(lat.max()),
+            mean_cycles=float(lat.mean()),
+            matches_model=bool((lat == PIPELINE_CYCLES).all()),
+        )
+    return rep
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Decode an ILA capture CSV.")
+    ap.add_argument("csv", nargs="?", default=ILA_CSV)
+    ap.add_argument("--npz", help="save the decoded columns here")
+    args = ap.parse_args()
+
+    if args.npz:
+        cols = load_ila(args.csv)
+        np.savez(args.npz, **cols)
+        for k, v in cols.items():
+            print(f"{k:<20} {v.dtype} {v.shape}")
+    rep = measure_latency(args.csv)
+    for k, v in rep.items():
+        print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import serial
+
+from softmax_batch import (
+    MAX_DEPTH,
+    MODE_LIMITS,
+    as_float32,
+    device_lengths,
+    length_modes,
+    softmax_batch,
+)
+
+# Rows per frame in packed modes 0..2, frames per row in modes 3..13.
+PACK = np.array([4, 2, 1], dtype=np.int64)
+GROUP_FRAMES = np.arange(2, len(MODE_LIMITS) - 1, dtype=np.int64)
+
+
+def mode_counts(rows: list) -> np.ndarray:
+    lengths = device_lengths([r.shape[0] for r in rows])
+    return np.bincount(length_modes(lengths), minlength=len(MODE_LIMITS))
+
+
+def layout_frames(counts: np.ndarray) -> int:
+    # Frames frame_layout() uses for rows with these per-mode counts.
+    packed = (counts[:3] + PACK - 1) // PACK
+    return int(packed.sum() + (counts[3:] * GROUP_FRAMES).sum())
+
+
+class SoftmaxMicroBatcher:
+    # Coalesces softmax_batch() calls from concurrent or consecutive callers
+    # into shared transactions. A batch is dispatched once window_s has
+    # passed since its first request, or as soon as the queued rows fill a
+    # whole transaction.
+
+    def __init__(
+        self,
+        ser: serial.Serial,
+        *,
+        window_s: float = 0.002,
+        max_rows_per_tx: int = MAX_DEPTH + 1,
+        pad_value: float = -32.0,
+        timeout_s: float = 10.0,
+    ):
+        self.ser = ser
+        self.window_s = window_s
+        self.max_rows_per_tx = max_rows_per_tx
+        self.pad_value = pad_value
+        self.timeout_s = timeout_s
+
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "rows": 0,
+            "frames": 0,
+            "transactions": 0,
+            "fill_ratio": 0.0,
+            "queue_delay_mean_s": 0.0,
+            "queue_delay_max_s": 0.0,
+        }
+        self._delay_sum = 0.0
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed
+
+    def submit(self, scores_list: list[np.ndarray]) -> Future:
+        # Rows are checked here, on the caller's thread: a bad request fails
+        # its own future and never reaches the dispatcher.
+        if self._closed:
+            raise RuntimeError("SoftmaxMicroBatcher is closed.")
+        fut: Future = Future()
+        try:
+            rows = [as_float32(r).reshape(-1) for r in scores_list]
+            if any(r.shape[0] < 1 for r in rows):
+                raise ValueError("Length must be at least 1.")
+            counts = mode_counts(rows) if rows else None
+        except Exception as e:
+            fut.set_exception(e)
+            return fut
+        if not rows:
+            fut.set_result([])
+            return fut
+        self._queue.put((rows, fut, time.perf_counter(), counts))
+        return fut
+
+    def softmax_batch(self, scores_list: list[np.ndarray]) -> list[np.ndarray]:
+        return self.submit(scores_list).result()
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = [item]
+            stop = False
+            try:
+                counts = item[3].copy()
+                deadline = item[2] + self.window_s
+
+                # Requests that queued up during the previous dispatch are
+                # past their window already; take them without waiting.
+                while layout_frames(counts) < self.max_rows_per_tx:
+                    wait = deadline - time.perf_counter()
+                    try:
+                        if wait > 0:
+                            nxt = self._queue.get(timeout=wait)
+                        else:
+                            nxt = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        stop = True
+                        break
+                    pending.append(nxt)
+                    counts += nxt[3]
+
+                self._dispatch(pending)
+            except Exception as e:
+                # Fail this batch, keep serving later requests.
+                for _, fut, _, _ in pending:
+                    if not fut.done():
+                        fut.set_exception(e)
+            if stop:
+                return
+
+    def _dispatch(self, pending: list) -> None:
+        t_start = time.perf_counter()
+        rows = [r for rows, _, _, _ in pending for r in rows]
+        batch_stats: dict = {}
+        try:
+            probs = softmax_batch(
+                self.ser,
+                rows,
+                pad_value=self.pad_value,
+                timeout_s=self.timeout_s,
+                max_rows_per_tx=self.max_rows_per_tx,
+                stats=batch_stats,
+            )
+        except Exception as e:
+            for _, fut, _, _ in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        st = self.stats
+        st["requests"] += len(pending)
+        st["batches"] += 1
+        st["rows"] += len(rows)
+        st["frames"] += batch_stats["frames"]
+        st["transactions"] += batch_stats["transactions"]
+        st["fill_ratio"] = st["frames"] / (st["transactions"] * self.max_rows_per_tx)
+        for _, _, t_submit, _ in pending:
+            delay = t_start - t_submit
+            self._delay_sum += delay
+            st["queue_delay_max_s"] = max(st["queue_delay_max_s"], delay)
+        st["queue_delay_mean_s"] = self._delay_sum / st["requests"]
+
+        off = 0
+        for rows_i, fut, _, _ in pending:
+            if not fut.done():
+                fut.set_result(probs[off : off + len(rows_i)])
+            off += len(rows_i)
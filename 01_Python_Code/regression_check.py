@@ -0,0 +1,201 @@
+import argparse
+import os
+import re
+import sys
+from typing import Optional
+
+import numpy as np
+
+from softmax_batch import (
+    BYTES_PER_ROW,
+    MAX_DEPTH,
+    SCALE,
+    close_serial,
+    open_serial,
+    recv_frames,
+    send_frame,
+)
+from softmax_emulator import (
+    EmulatedDevice,
+    group_spans,
+    log2_approx,
+    pow2_approx,
+    wrap16,
+)
+
+# Checks emulator or board output against the RTL testbench dumps in
+# 01_Testbench and the exact probabilities in 04_Python_Code/comp.txt.
+# Errors are reported per lane in probability units and in Q6.10 ULPs.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TB_DIR = os.path.join(ROOT, "00_Softmax_Approx_with_Tree", "01_Testbench")
+COMP_TXT = os.path.join(
+    ROOT, "00_Softmax_Approx_with_Tree", "04_Python_Code", "comp.txt"
+)
+
+_FLOAT = r"-?\d+\.\d+"
+
+
+def parse_softmax_tb(sv_path: str) -> tuple[np.ndarray, np.ndarray]:
+    # Stimulus of softmax_approx_tb.sv: the {8{...}} localparam patterns and
+    # the (i_in_x_flat, i_length_mode) sequence. Lanes are in o_prob_flat
+    # order (lane 0 = least significant 16 bits).
+    text = open(sv_path).read()
+    patterns = {}
+    for name, rep, body in re.findall(
+        r"localparam\s*\[1023:0\]\s*(\w+)\s*=\s*\{(\d+)\{([^}]*)\}\}", text
+    ):
+        words = [int(h, 16) for h in re.findall(r"16'h([0-9A-Fa-f]+)", body)]
+        msb_first = np.array(words * int(rep), dtype=np.uint16)
+        patterns[name] = msb_first[::-1].view(np.int16)
+    seq = re.findall(
+        r"i_in_x_flat\s*=\s*(\w+);\s*i_valid\s*=\s*1;\s*i_length_mode\s*=\s*(\d+);",
+        text,
+    )
+    x = np.stack([patterns[name] for name, _ in seq])
+    modes = np.array([int(m) for _, m in seq], dtype=np.int64)
+    return x, modes
+
+
+def parse_tb_output(md_path: str) -> tuple[np.ndarray, np.ndarray]:
+    # softmax_approx_tb_output.md: "Mode: N" then 64 "%f" lanes per frame.
+    # Returns (modes, raw Q6.10 lanes).
+    blocks = re.split(r"Mode:\s*", open(md_path).read())[1:]
+    modes = np.array([int(b.split()[0]) for b in blocks], dtype=np.int64)
+    vals = [re.findall(_FLOAT, b) for b in blocks]
+    probs = np.array(vals, dtype=np.float64)
+    return modes, np.rint(probs * SCALE).astype(np.int64)
+
+
+def parse_pairs(
+    md_path: str, in_pat: str, out_pat: str
+) -> tuple[np.ndarray, np.ndarray]:
+    text = open(md_path).read()
+    x = np.array(re.findall(in_pat, text), dtype=np.float64)
+    y = np.array(re.findall(out_pat, text), dtype=np.float64)
+    return np.rint(x * SCALE).astype(np.int64), np.rint(y * SCALE).astype(np.int64)
+
+
+def parse_comp_txt(path: str) -> np.ndarray:
+    vals = np.array(open(path).read().split(), dtype=np.float64)
+    return vals.reshape(-1, 64)
+
+
+def run_frames(
+    ser, x: np.ndarray, modes: np.ndarray, timeout_s: float = 5.0
+) -> np.ndarray:
+    # x in o_prob_flat lane order; the wire carries lane 63 first. Returns
+    # raw Q6.10 output lanes in the same order.
+    frames = np.zeros((x.shape[0], BYTES_PER_ROW), dtype=np.uint8)
+    frames[:, 0] = modes & 0x0F
+    frames[:, 1:].view(">i2")[...] = x[:, ::-1]
+
+    transact = getattr(ser, "transact", None)
+    if transact is not None:
+        rx = transact(frames)
+    else:
+        # Cut into transactions without splitting a group.
+        ends = {e for _, e in group_spans(modes)}
+        inside = np.zeros(x.shape[0] + 1, dtype=bool)
+        for a, e in group_spans(modes):
+            inside[a + 1 : e] = True
+        rx_rows = []
+        start = 0
+        while start < x.shape[0]:
+            stop = min(x.shape[0], start + MAX_DEPTH + 1)
+            while inside[stop] and stop not in ends:
+                stop -= 1
+            send_frame(ser, stop - start - 1, [f.tobytes() for f in frames[start:stop]])
+            rx_rows.extend(recv_frames(ser, stop - start - 1, timeout_s=timeout_s))
+            start = stop
+        rx = np.frombuffer(b"".join(rx_rows), dtype=np.uint8).reshape(-1, BYTES_PER_ROW)
+    return rx[:, 1:].view(">i2")[:, ::-1].astype(np.int64)
+
+
+def lane_errors(
+    got_raw: np.ndarray, ref: np.ndarray, *, ref_is_raw: bool = True
+) -> dict:
+    # Per-lane max-abs error (probability units) and max ULP (1/1024).
+    got = got_raw / SCALE
+    ref_f = ref / SCALE if ref_is_raw else ref
+    err = np.abs(got - ref_f)
+    ulp = err * SCALE
+    return {
+        "vectors": int(got.shape[0]),
+        "lane_max_abs": err.max(axis=0),
+        "lane_max_ulp": ulp.max(axis=0),
+        "max_abs": float(err.max()) if err.size else 0.0,
+        "max_ulp": float(ulp.max()) if ulp.size else 0.0,
+        "mismatched_vectors": int((ulp > 0.5).any(axis=1).sum()),
+    }
+
+
+def check_all(
+    ser=None, tb_dir: str = TB_DIR, comp_txt: Optional[str] = COMP_TXT
+) -> dict:
+    if ser is None:
+        ser = EmulatedDevice()
+    results = {}
+
+    x, modes = parse_softmax_tb(os.path.join(tb_dir, "softmax_approx_tb.sv"))
+    ref_modes, ref = parse_tb_output(
+        os.path.join(tb_dir, "softmax_approx_tb_output.md")
+    )
+    if not np.array_equal(modes, ref_modes):
+        raise RuntimeError("softmax_approx_tb stimulus and output modes disagree")
+    got = run_frames(ser, x, modes)
+    results["softmax_approx_tb"] = lane_errors(got, ref)
+
+    if comp_txt is not None and os.path.exists(comp_txt):
+        comp = parse_comp_txt(comp_txt)
+        n = min(comp.shape[0], got.shape[0])
+        # Exact reference: reports the approximation error, not a pass/fail.
+        results["comp_txt"] = lane_errors(got[:n], comp[:n], ref_is_raw=False)
+
+    xin, yout = parse_pairs(
+        os.path.join(tb_dir, "stage1_log2_approx_tb_output.md"),
+        rf"in0 : ({_FLOAT})",
+        rf"out : ({_FLOAT})",
+    )
+    results["stage1_log2_approx_tb"] = lane_errors(
+        wrap16(log2_approx(xin))[:, None], yout[:, None]
+    )
+    xin, yout = parse_pairs(
+        os.path.join(tb_dir, "stage3_pow2_approx_tb_output.md"),
+        rf"Input:\s*\n\s*({_FLOAT})",
+        rf"Output:\s*\n\s*({_FLOAT})",
+    )
+    results["stage3_pow2_approx_tb"] = lane_errors(
+        wrap16(pow2_approx(xin))[:, None], yout[:, None]
+    )
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Regression check against RTL dumps.")
+    ap.add_argument("--port", help="serial port of the board (default: emulator)")
+    ap.add_argument("--baud", type=int, default=115200)
+    args = ap.parse_args()
+
+    ser = open_serial(args.port, baud=args.baud) if args.port else EmulatedDevice()
+    try:
+        results = check_all(ser)
+    finally:
+        if args.port:
+            close_serial(ser)
+
+    failed = False
+    for name, r in results.items():
+        print(
+            f"{name:<24} vectors={r['vectors']:<5} max_abs={r['max_abs']:.6f} "
+            f"max_ulp={r['max_ulp']:.1f} mismatched={r['mismatched_vectors']}"
+        )
+        if name != "comp_txt" and r["mismatched_vectors"]:
+            failed = True
+            worst = np.argsort(r["lane_max_ulp"])[::-1][:8]
+            print(f"  worst lanes: {worst.tolist()}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import glob
+import os
+import queue
+import threading
+from typing import Iterator, Optional
+
+import numpy as np
+
+from softmax_batch import as_float32
+
+# Opt-in capture of pre-softmax attention scores from the patched BERT/GPT-2
+# layers, for replaying real length and value distributions through the
+# transport and packing benchmarks. Each row keeps only its valid entries
+# (what the device would be sent) plus (seq, layer, head, query, length).
+# Rows are buffered up to chunk_values scores and handed to a writer
+# thread as compressed chunk_NNNNN.npz files; at most max_pending chunks
+# wait for the disk, after which record() blocks.
+
+CHUNK_VALUES = 1 << 22
+MAX_PENDING = 2
+
+
+class ScoreRecorder:
+    def __init__(
+        self,
+        path: str,
+        *,
+        chunk_values: int = CHUNK_VALUES,
+        max_pending: int = MAX_PENDING,
+    ):
+        os.makedirs(path, exist_ok=True)
+        if glob.glob(os.path.join(path, "chunk_*.npz")):
+            raise ValueError(f"{path} already holds a score corpus")
+        self.path = path
+        self.chunk_values = chunk_values
+        self.stats = {"rows": 0, "values": 0, "chunks": 0, "bytes": 0}
+
+        self._parts: list[dict[str, np.ndarray]] = []
+        self._buffered = 0
+        self._seq_base = 0
+        self._last_layer = -1
+        self._last_batch = 0
+        self._error: Optional[BaseException] = None
+        self._q: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self._thread.start()
+
+    def _write_chunks(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            k, arrays = item
+            try:
+                fname = os.path.join(self.path, f"chunk_{k:05d}.npz")
+                np.savez_compressed(fname, **arrays)
+                self.stats["bytes"] += os.path.getsize(fname)
+            except BaseException as exc:
+                self._error = exc
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("score recorder write failed") from self._error
+
+    def record(self, scores, mask=None, *, layer: int) -> None:
+        # scores: (B, H, Tq, Tk); mask broadcasts to it, False entries are
+        # dropped and empty rows skipped. Sequence ids advance by B whenever
+        # the layer index does not increase (a new forward pass).
+        self._check()
+        x = as_float32(scores)
+        if x.ndim != 4:
+            raise ValueError("scores must be shape (B, H, Tq, Tk)")
+        if mask is None:
+            valid = np.ones(x.shape, dtype=bool)
+        else:
+            if hasattr(mask, "detach"):
+                mask = mask.detach().cpu().numpy()
+            valid = np.broadcast_to(np.asarray(mask, dtype=bool), x.shape)
+
+        if layer <= self._last_layer:
+            self._seq_base += self._last_batch
+        self._last_layer, self._last_batch = layer, x.shape[0]
+
+        lens = valid.sum(axis=-1)
+        b, h, q = np.nonzero(lens)
+        part = {
+            "values": x[valid],
+            "lengths": lens[b, h, q].astype(np.int32),
+            "seq": (self._seq_base + b).astype(np.int64),
+            "layer": np.full(b.size, layer, dtype=np.int16),
+            "head": h.astype(np.int16),
+            "query": q.astype(np.int32),
+        }
+        self._parts.append(part)
+        self._buffered += part["values"].size
+        self.stats["rows"] += b.size
+        self.stats["values"] += part["values"].size
+        if self._buffered >= self.chunk_values:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._parts:
+            return
+        keys = self._parts[0].keys()
+        arrays = {k: np.concatenate([p[k] for p in self._parts]) for k in keys}
+        self._parts, self._buffered = [], 0
+        self._q.put((self.stats["chunks"], arrays))
+        self.stats["chunks"] += 1
+        self._check()
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._q.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_corpus(path: str) -> Iterator[dict[str, np.ndarray]]:
+    # Yields the chunks in recording order; "offsets" gives the start of
+    # each row in "values".
+    for fname in sorted(glob.glob(os.path.join(path, "chunk_*.npz"))):
+        with np.load(fname) as z:
+            chunk = {k: z[k] for k in z.files}
+        lens = chunk["lengths"].astype(np.int64)
+        chunk["offsets"] = np.cumsum(lens) - lens
+        yield chunk
+
+
+def load_rows(
+    path: str, max_rows: Optional[int] = None
+) -> tuple[list[np.ndarray], dict]:
+    # Recorded rows as float32 arrays plus their metadata columns, ready
+    # for softmax_batch() / plan_batch().
+    rows: list[np.ndarray] = []
+    meta: dict[str, list[np.ndarray]] = {}
+    for chunk in iter_corpus(path):
+        n = chunk["lengths"].size
+        if max_rows is not None:
+            n = min(n, max_rows - len(rows))
+        rows.extend(np.split(chunk["values"], chunk["offsets"][1 : n + 1])[:n])
+        for k in ("lengths", "seq", "layer", "head", "query"):
+            meta.setdefault(k, []).append(chunk[k][:n])
+        if max_rows is not None and len(rows) >= max_rows:
+            break
+    return rows, {k: np.concatenate(v) for k, v in meta.items()}
@@ -0,0 +1,135 @@
+import numpy as np
+
+from softmax_batch import BYTES_PER_ROW, LOG2E_FX
+
+# Bit-exact model of 00_Design_source/00_softmax_approx. Values are carried
+# as int64 and wrapped to the RTL register widths where the RTL wraps.
+
+# stage1_log2_approx integer part, indexed by the leading-zero count of the
+# Q22.10 sum. Counts 1..6 are one above 21 - zcnt in the RTL table, and a
+# zero count of 0 (bit 31 set, or a zero sum) maps to 0x20.
+LOG2_INT_PART = np.array(
+    [0x20]
+    + [22 - z for z in range(1, 7)]
+    + [(21 - z) & 0x3F for z in range(7, 32)],
+    dtype=np.int64,
+)
+
+
+def wrap16(x) -> np.ndarray:
+    return ((np.asarray(x, dtype=np.int64) + 0x8000) & 0xFFFF) - 0x8000
+
+
+def pow2_approx(x) -> np.ndarray:
+    # stage3_pow2_approx: {1'b1, x[9:0], 5'b0} >> shift, with the shift
+    # taken from the signed integer part x[15:10]; outside -10..5 the
+    # result is 0. Returns the raw 16-bit output (0..0xFFE0).
+    x = np.asarray(x, dtype=np.int64) & 0xFFFF
+    x_int = x >> 10
+    x_int = np.where(x_int >= 32, x_int - 64, x_int)
+    shift = np.where((x_int >= -10) & (x_int <= 5), 5 - x_int, 16)
+    return (0x8000 | ((x & 0x3FF) << 5)) >> shift
+
+
+def log2_approx(s) -> np.ndarray:
+    # stage1_log2_approx: Mitchell log2 of a 32-bit sum, Q6.10 raw bits.
+    s = np.asarray(s, dtype=np.int64) & 0xFFFFFFFF
+    _, bit_len = np.frexp(s.astype(np.float64))
+    zcnt = np.where((s == 0) | (bit_len == 32), 0, 32 - bit_len)
+    frac = (((s << zcnt) & 0xFFFFFFFF) >> 21) & 0x3FF
+    return (LOG2_INT_PART[zcnt] << 10) | frac
+
+
+def ru(in1, ref, mult: int) -> np.ndarray:
+    # RU datapath after the log2 stage: ((in1 - ref) * mult)[25:10].
+    sub = wrap16(np.asarray(in1, dtype=np.int64) - ref)
+    return wrap16((sub * mult) >> 10)
+
+
+def group_spans(modes) -> list[tuple[int, int]]:
+    # max_forwarding / acc_forwarding counter: a run of group-mode frames
+    # closes when the frame count reaches (mode - 1) of the closing frame.
+    # Frames of an unfinished run keep their own 64-lane values.
+    spans: list[tuple[int, int]] = []
+    cnt = 0
+    for k, m in enumerate(np.asarray(modes).tolist()):
+        if 3 <= m <= 13:
+            if cnt == m - 2:
+                spans.append((k - cnt, k + 1))
+                cnt = 0
+            else:
+                cnt += 1
+        else:
+            cnt = 0
+    return spans
+
+
+def block_reduce(v: np.ndarray, modes: np.ndarray, spans, ufunc) -> np.ndarray:
+    # Broadcasts the per-block reduction back onto the lanes: 16/32-lane
+    # blocks for modes 0/1, the whole frame otherwise, and the whole group
+    # for frames in a closed group span.
+    out = np.empty_like(v)
+    for mode in (0, 1):
+        rows = np.flatnonzero(modes == mode)
+        if rows.size:
+            b = 16 << mode
+            r = ufunc.reduce(v[rows].reshape(rows.size, 64 // b, b), axis=2)
+            out[rows] = np.repeat(r, b, axis=1)
+    rows = np.flatnonzero(modes >= 2)
+    if rows.size:
+        out[rows] = ufunc.reduce(v[rows], axis=1)[:, None]
+    if spans:
+        starts = np.array([a for a, _ in spans], dtype=np.int64)
+        sizes = np.array([b - a for a, b in spans], dtype=np.int64)
+        rows = np.repeat(starts, sizes) + (
+            np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        )
+        loc = out[rows, 0]
+        tot = ufunc.reduceat(loc, np.cumsum(sizes) - sizes)
+        out[rows] = np.repeat(tot, sizes)[:, None]
+    return out
+
+
+def softmax_approx(x, modes) -> np.ndarray:
+    # x: (N, 64) Q6.10 frames in stream order, modes: (N,) 4-bit headers.
+    # Returns the (N, 64) int16 o_prob_flat lanes. Block reductions are
+    # symmetric, so lane order within a frame does not matter.
+    x = np.asarray(x, dtype=np.int16).astype(np.int64)
+    if x.ndim != 2 or x.shape[1] != 64:
+        raise ValueError("x must be shape (N, 64)")
+    modes = np.asarray(modes, dtype=np.int64) & 0x0F
+    if modes.shape != (x.shape[0],):
+        raise ValueError("modes must be shape (N,)")
+
+    spans = group_spans(modes)
+    mx = block_reduce(x, modes, spans, np.maximum)
+    u = ru(x, mx, LOG2E_FX)
+    e = wrap16(pow2_approx(u))
+    s = block_reduce(e, modes, spans, np.add)
+    S = ru(u, log2_approx(s), 0x0400)
+    return wrap16(pow2_approx(S)).astype(np.int16)
+
+
+class EmulatedDevice:
+    # Stand-in for the UART port: softmax_batch() hands it whole batches of
+    # 129-byte rows through transact() instead of driving the wire.
+
+    is_open = True
+
+    def __init__(self):
+        self.frames = 0
+        self.transactions = 0
+
+    def transact(self, frames_u8: np.ndarray) -> np.ndarray:
+        frames_u8 = np.asarray(frames_u8, dtype=np.uint8)
+        if frames_u8.ndim != 2 or frames_u8.shape[1] != BYTES_PER_ROW:
+            raise ValueError(f"frames must be shape (N, {BYTES_PER_ROW})")
+        x = frames_u8[:, 1:].copy().view(">i2")
+        out = np.zeros_like(frames_u8)
+        out[:, 1:].view(">i2")[...] = softmax_approx(x, frames_u8[:, 0])
+        self.frames += frames_u8.shape[0]
+        self.transactions += 1
+        return out
+
+    def close(self) -> None:
+        self.is_open = False
@@ -0,0 +1,110 @@
+import torch
+from typing import Optional
+
+from softmax_batch import I16_MAX, I16_MIN, LOG2E_FX, MAX_DEVICE_LEN, SCALE
+from softmax_emulator import LOG2_INT_PART
+
+# Torch port of softmax_emulator.softmax_approx for in-graph use. Each row is
+# treated as the device would see it when sent alone at its valid length:
+# its own 16/32/64-lane block or (mode - 1)-frame group, filled up with
+# pad lanes. All pad lanes are equal, so they enter the max and the sum as
+# (count * value) instead of being materialized.
+
+
+def _wrap16(x: torch.Tensor) -> torch.Tensor:
+    return ((x + 0x8000) & 0xFFFF) - 0x8000
+
+
+def pow2_approx(x: torch.Tensor) -> torch.Tensor:
+    x = x & 0xFFFF
+    x_int = x >> 10
+    x_int = torch.where(x_int >= 32, x_int - 64, x_int)
+    in_range = (x_int >= -10) & (x_int <= 5)
+    shift = torch.where(in_range, 5 - x_int, torch.full_like(x_int, 16))
+    return (0x8000 | ((x & 0x3FF) << 5)) >> shift
+
+
+def log2_approx(s: torch.Tensor) -> torch.Tensor:
+    s = s & 0xFFFFFFFF
+    bit_len = torch.frexp(s.double()).exponent.long()
+    zcnt = torch.where((s == 0) | (bit_len == 32), torch.zeros_like(s), 32 - bit_len)
+    frac = (((s << zcnt) & 0xFFFFFFFF) >> 21) & 0x3FF
+    table = torch.as_tensor(LOG2_INT_PART, device=s.device)
+    return (table[zcnt] << 10) | frac
+
+
+def _ru(in1: torch.Tensor, ref: torch.Tensor, mult: int) -> torch.Tensor:
+    return _wrap16((_wrap16(in1 - ref) * mult) >> 10)
+
+
+def quantize_q6_10(scores: torch.Tensor) -> torch.Tensor:
+    # Same rounding as softmax_batch.encode_q6_10: float32 scale, NaN -> 0,
+    # saturate, round half to even.
+    x = scores.float() * SCALE
+    x = torch.nan_to_num(x, nan=0.0, posinf=float(I16_MAX), neginf=float(I16_MIN))
+    return torch.round(x.clamp(I16_MIN, I16_MAX)).long()
+
+
+def block_lanes(n: torch.Tensor) -> torch.Tensor:
+    # Lanes the device spends on a row of length n: 16/32/64 for the packed
+    # modes, 64 * (mode - 1) for the multi-row groups.
+    return torch.where(
+        n <= 16,
+        torch.full_like(n, 16),
+        torch.where(n <= 32, torch.full_like(n, 32), (n + 63) // 64 * 64),
+    )
+
+
+def softmax_approx(
+    scores: torch.Tensor,
+    mask: Optional[torch.Tensor] = None,
+    pad_value: float = -32.0,
+) -> torch.Tensor:
+    # Softmax over the last axis; entries where mask is False get 0 and do
+    # not count towards the row length. Bit-exact with softmax_rows() on an
+    # EmulatedDevice for rows up to MAX_DEVICE_LEN valid entries.
+    x = quantize_q6_10(scores)
+    if mask is None:
+        valid = torch.ones_like(x, dtype=torch.bool)
+    else:
+        valid = mask.to(device=x.device, dtype=torch.bool).expand(x.shape)
+
+    n = valid.sum(dim=-1, keepdim=True)
+    if int(n.max()) > MAX_DEVICE_LEN:
+        raise ValueError(
+            f"rows longer than {MAX_DEVICE_LEN} need chunked offload; "
+            "use softmax_batch.softmax_rows()"
+        )
+    n_pad = block_lanes(n) - n
+    q_pad = int(quantize_q6_10(torch.tensor(pad_value)))
+
+    mx = torch.where(valid, x, torch.full_like(x, I16_MIN)).amax(dim=-1, keepdim=True)
+    mx = torch.where(n_pad > 0, mx.clamp(min=q_pad), mx)
+
+    u = _ru(x, mx, LOG2E_FX)
+    e = torch.where(valid, _wrap16(pow2_approx(u)), torch.zeros_like(u))
+    u_pad = _ru(torch.full_like(mx, q_pad), mx, LOG2E_FX)
+    s = e.sum(dim=-1, keepdim=True) + n_pad * _wrap16(pow2_approx(u_pad))
+
+    p = _wrap16(pow2_approx(_ru(u, log2_approx(s), 0x0400)))
+    p = torch.where(valid, p, torch.zeros_like(p))
+    return p.to(scores.dtype if scores.is_floating_point() else torch.float32) / SCALE
+
+
+class TorchApproxSoftmax:
+    # Drop-in for the serial port in the attention patchers: they call
+    # softmax_tensor() on the whole (B, H, Tq, Tk) score tensor instead of
+    # offloading row by row.
+
+    is_open = True
+
+    def __init__(self, pad_value: float = -32.0):
+        self.pad_value = pad_value
+
+    def softmax_tensor(
+        self, scores: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        return softmax_approx(scores, mask, pad_value=self.pad_value)
+
+    def close(self) -> None:
+        self.is_open = False
@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from softmax_batch import BITS_PER_BYTE, BYTES_PER_ROW, BatchPlan
+
+# Pipeline depths of softmax_approx in clock cycles.
+MAX_TREE_CYCLES = 6
+MAX_FORWARD_CYCLES = 12
+# RU: stage1 log2 (3) + sub_FX16 (2) + mult_FX16 (4) + stage3 pow2 (2)
+RU_CYCLES = 11
+ADD_TREE_CYCLES = 12
+ACC_FORWARD_CYCLES = 12
+# The forwarding delay lines are 12 deep for every length mode (group
+# results are loaded back into earlier slots), so the latency from frame in
+# to frame out does not depend on the mode.
+PIPELINE_CYCLES = (
+    MAX_TREE_CYCLES
+    + MAX_FORWARD_CYCLES
+    + RU_CYCLES
+    + ADD_TREE_CYCLES
+    + ACC_FORWARD_CYCLES
+    + RU_CYCLES
+)
+
+# BRAM_FSM: r_valid delay (3) before the first frame reaches the core and
+# the dina buffer (1) before the first write; plus S_W_DONE, S_R_WAIT, the
+# busy drop seen by S_CORE_WAIT, S_CORE_START and the R_IDLE -> R_READ step.
+BRAM_READ_CYCLES = 3
+BRAM_WRITE_CYCLES = 1
+CORE_HANDSHAKE_CYCLES = 5
+# uart_bram_controller: S_TX_REQ, S_TX_WAIT_1, S_TX_WAIT_2, S_TX_LOAD per
+# row, and S_TX_SEND -> uart_tx IDLE -> ... -> RESET -> S_TX_CHECK per byte.
+TX_ROW_CYCLES = 4
+TX_BYTE_CYCLES = 3
+
+
+@dataclass
+class TimingModel:
+    # Cycle-level latency of one transaction: the host's request on the RX
+    # line, the BRAM_FSM pass through softmax_approx, and the result rows on
+    # the TX line. host_baud is the rate the host actually drives (RX), the
+    # device UARTs run at clk_hz / clks_per_bit.
+    clk_hz: float = 100e6
+    clks_per_bit: int = 868
+    host_baud: Optional[float] = None
+
+    @classmethod
+    def for_baud(cls, baud: float, clk_hz: float = 100e6) -> "TimingModel":
+        return cls(clk_hz=clk_hz, clks_per_bit=round(clk_hz / baud), host_baud=baud)
+
+    @property
+    def device_baud(self) -> float:
+        return self.clk_hz / self.clks_per_bit
+
+    def rx_cycles(self, n_rows: int) -> int:
+        # Bytes arrive back to back at the host rate; uart_rx raises
+        # o_rx_done in the middle of the last stop bit, and S_RX_WRITE
+        # stores the last row one cycle later.
+        baud = self.host_baud or self.device_baud
+        n_bytes = 1 + n_rows * BYTES_PER_ROW
+        line = (n_bytes - 1) * BITS_PER_BYTE * self.clk_hz / baud
+        last = (BITS_PER_BYTE - 0.5) * self.clks_per_bit
+        return round(line + last) + 1
+
+    def core_cycles(self, n_rows: int) -> int:
+        # Frames stream through the pipeline one per cycle, so a whole
+        # transaction costs its depth once plus the fill latency.
+        return (
+            CORE_HANDSHAKE_CYCLES
+            + BRAM_READ_CYCLES
+            + PIPELINE_CYCLES
+            + BRAM_WRITE_CYCLES
+            + n_rows
+        )
+
+    def tx_cycles(self, n_rows: int) -> int:
+        byte = BITS_PER_BYTE * self.clks_per_bit + TX_BYTE_CYCLES
+        return n_rows * (TX_ROW_CYCLES + BYTES_PER_ROW * byte)
+
+    def transaction_cycles(self, n_rows: int) -> dict[str, int]:
+        rx = self.rx_cycles(n_rows)
+        core = self.core_cycles(n_rows)
+        tx = self.tx_cycles(n_rows)
+        return {"rx": rx, "core": core, "tx": tx, "total": rx + core + tx}
+
+    def transaction_seconds(self, n_rows: int) -> float:
+        return self.transaction_cycles(n_rows)["total"] / self.clk_hz
+
+    def tx_overhead_s(self, n_rows: int) -> float:
+        # Time on top of the raw 10-bit byte times, for plan_batch().
+        wire = (1 + 2 * n_rows * BYTES_PER_ROW) * BITS_PER_BYTE / self.device_baud
+        return self.transaction_seconds(n_rows) - wire
+
+    def plan_seconds(self, plan: BatchPlan) -> float:
+        return sum(self.transaction_seconds(d + 1) for d in plan.depths)
+
+    def report(self, plan: BatchPlan, measured_s: Optional[float] = None) -> dict:
+        phases = {"rx": 0, "core": 0, "tx": 0}
+        for d in plan.depths:
+            for k, v in self.transaction_cycles(d + 1).items():
+                if k in phases:
+                    phases[k] += v
+        model_s = sum(phases.values()) / self.clk_hz
+        rep = {
+            "transactions": len(plan.transactions),
+            "frames": plan.n_frames,
+            "rx_s": phases["rx"] / self.clk_hz,
+            "core_s": phases["core"] / self.clk_hz,
+            "tx_s": phases["tx"] / self.clk_hz,
+            "model_s": model_s,
+        }
+        if measured_s is not None:
+            rep["measured_s"] = measured_s
+            rep["host_overhead_s"] = measured_s - model_s
+            rep["efficiency"] = model_s / measured_s if measured_s > 0 else 0.0
+        return rep
@@ -0,0 +1,282 @@
+import argparse
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+
+from softmax_batch import BYTES_PER_ROW, encode_q6_10, frames_to_bytes
+
+# Test-vector files for the board and the BRAM init, all holding the same
+# 129-byte rows ({4'b0, mode} header byte + 64 big-endian Q6.10 lanes):
+#   .hex  one row per line, 257 (1028-bit, as input_1028b.hex) or 258 digits
+#   .coe  Vivado BRAM init (memory_initialization_vector, radix 16)
+#   .bin  raw rows back to back, exactly what goes over the UART
+#   .npy  (N, 64) int16 lanes in payload order (as frames_to_bytes) with the
+#         modes in a "<name>_modes.npy" sidecar; float arrays are quantized
+# Files are memory-mapped and converted BLOCK_ROWS rows at a time.
+
+BLOCK_ROWS = 1 << 14
+HEX_DIGITS = 2 * BYTES_PER_ROW
+DEFAULT_MODE = 2
+VECTOR_FORMATS = {
+    ".hex": "hex",
+    ".txt": "hex",
+    ".coe": "coe",
+    ".bin": "bin",
+    ".raw": "bin",
+    ".npy": "npy",
+}
+
+_HEX = np.full(256, 0xFF, dtype=np.uint8)
+for _i, _c in enumerate("0123456789abcdef"):
+    _HEX[ord(_c)] = _i
+    _HEX[ord(_c.upper())] = _i
+_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+
+def vector_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in VECTOR_FORMATS:
+        raise ValueError(f"unknown vector file type: {path}")
+    return VECTOR_FORMATS[ext]
+
+
+def modes_path(path: str) -> str:
+    return os.path.splitext(path)[0] + "_modes.npy"
+
+
+def _coe_body(buf: np.ndarray) -> np.ndarray:
+    # Skips the header up to "memory_initialization_vector =".
+    head = bytes(buf[: min(buf.size, 4096)]).lower()
+    radix = head.find(b"memory_initialization_radix")
+    if radix >= 0:
+        value = head[radix:].split(b"=", 1)[1].split(b";", 1)[0].strip()
+        if value != b"16":
+            raise ValueError(f"only radix 16 .coe files are supported, got {value!r}")
+    key = head.find(b"memory_initialization_vector")
+    if key < 0:
+        raise ValueError("missing memory_initialization_vector in .coe file")
+    return buf[head.index(b"=", key) + 1 :]
+
+
+def _tokens_to_frames(
+    buf: np.ndarray, starts: np.ndarray, ends: np.ndarray
+) -> np.ndarray:
+    # Hex tokens buf[starts[i]:ends[i]] -> (n, 129) rows, right-aligned.
+    lens = ends - starts
+    if lens.size and lens.max() > HEX_DIGITS:
+        raise ValueError(f"hex row wider than {HEX_DIGITS} digits")
+    nib = np.zeros((lens.size, HEX_DIGITS), dtype=np.uint8)
+    stride = np.diff(starts)
+    if lens.size > 1 and (lens == lens[0]).all() and (stride == stride[0]).all():
+        # Evenly spaced rows of one width (any file this module writes).
+        n, w, st = lens.size, int(lens[0]), int(stride[0])
+        rows = buf[starts[0] : starts[0] + n * st]
+        if rows.size < n * st:
+            rows = np.concatenate((rows, np.zeros(n * st - rows.size, np.uint8)))
+        nib[:, HEX_DIGITS - w :] = _HEX[rows.reshape(n, st)[:, :w]]
+        return (nib[:, 0::2] << 4) | nib[:, 1::2]
+    for w in np.unique(lens):
+        rows = np.flatnonzero(lens == w)
+        idx = starts[rows, None] + np.arange(w)
+        nib[rows, HEX_DIGITS - w :] = _HEX[buf[idx]]
+    return (nib[:, 0::2] << 4) | nib[:, 1::2]
+
+
+def _iter_text(
+    buf: np.ndarray, block_rows: int, decode: bool = True
+) -> Iterator[np.ndarray]:
+    # Hex tokens are maximal runs of hex digits; anything else (newlines,
+    # CR, commas, ';', indentation) separates rows.
+    step = block_rows * (HEX_DIGITS + 8)
+    pos = 0
+    while pos < buf.size:
+        end = min(buf.size, pos + step)
+        blk = buf[pos:end]
+        is_hex = _HEX[blk] != 0xFF
+        if end < buf.size:
+            # Cut after the last separator so no token straddles blocks.
+            seps = np.flatnonzero(~is_hex)
+            if seps.size == 0:
+                raise ValueError("hex row too long")
+            end = pos + int(seps[-1]) + 1
+            blk, is_hex = blk[: end - pos], is_hex[: end - pos]
+        edges = np.diff(np.concatenate(([False], is_hex, [False])).astype(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        if starts.size:
+            yield _tokens_to_frames(blk, starts, ends) if decode else starts
+        pos = end
+
+
+def iter_frames(
+    path: str,
+    *,
+    modes: Optional[str] = None,
+    block_rows: int = BLOCK_ROWS,
+) -> Iterator[np.ndarray]:
+    # Yields (n, 129) uint8 row blocks from any supported file.
+    fmt = vector_format(path)
+    if fmt == "npy":
+        lanes = np.load(path, mmap_mode="r")
+        if lanes.ndim != 2 or lanes.shape[1] != 64:
+            raise ValueError("lanes must be shape (N, 64)")
+        mp = modes or modes_path(path)
+        hdr = np.load(mp, mmap_mode="r") if os.path.exists(mp) else None
+        if hdr is not None and hdr.shape != (lanes.shape[0],):
+            raise ValueError(f"modes must be shape ({lanes.shape[0]},)")
+        for s in range(0, lanes.shape[0], block_rows):
+            blk = lanes[s : s + block_rows]
+            if np.issubdtype(blk.dtype, np.floating):
+                blk = encode_q6_10(blk)
+            m = hdr[s : s + block_rows] if hdr is not None else DEFAULT_MODE
+            yield frames_to_bytes(blk, np.broadcast_to(m, (blk.shape[0],)))
+        return
+
+    if os.path.getsize(path) == 0:
+        return
+    buf = np.memmap(path, dtype=np.uint8, mode="r")
+    if fmt == "bin":
+        if buf.size % BYTES_PER_ROW:
+            raise ValueError(f"raw file size is not a multiple of {BYTES_PER_ROW}")
+        rows = buf.reshape(-1, BYTES_PER_ROW)
+        for s in range(0, rows.shape[0], block_rows):
+            yield np.array(rows[s : s + block_rows])
+        return
+    if fmt == "coe":
+        buf = _coe_body(buf)
+    yield from _iter_text(buf, block_rows)
+
+
+def count_frames(path: str, *, block_rows: int = BLOCK_ROWS) -> int:
+    fmt = vector_format(path)
+    if fmt == "npy":
+        return int(np.load(path, mmap_mode="r").shape[0])
+    if fmt == "bin":
+        return os.path.getsize(path) // BYTES_PER_ROW
+    buf = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else None
+    if buf is None:
+        return 0
+    if fmt == "coe":
+        buf = _coe_body(buf)
+    return sum(t.size for t in _iter_text(buf, block_rows, decode=False))
+
+
+def read_frames(path: str, *, modes: Optional[str] = None) -> np.ndarray:
+    blocks = list(iter_frames(path, modes=modes))
+    if not blocks:
+        return np.zeros((0, BYTES_PER_ROW), dtype=np.uint8)
+    return np.concatenate(blocks)
+
+
+def split_frames(frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # (n, 129) rows -> ((n, 64) int16 payload lanes, (n,) uint8 modes).
+    frames = np.asarray(frames, dtype=np.uint8)
+    lanes = frames[:, 1:].copy().view(">i2").astype(np.int16)
+    return lanes, frames[:, 0] & 0x0F
+
+
+def _hex_lines(frames: np.ndarray, digits: int) -> bytes:
+    nib = np.empty((frames.shape[0], HEX_DIGITS), dtype=np.uint8)
+    nib[:, 0::2] = frames >> 4
+    nib[:, 1::2] = frames & 0x0F
+    if digits < HEX_DIGITS and nib[:, : HEX_DIGITS - digits].any():
+        raise ValueError(f"header does not fit in {digits} hex digits")
+    out = np.empty((frames.shape[0], digits + 1), dtype=np.uint8)
+    out[:, :digits] = _DIGITS[nib[:, HEX_DIGITS - digits :]]
+    out[:, digits] = ord("\n")
+    return out.tobytes()
+
+
+def write_frames(
+    path: str,
+    blocks,
+    *,
+    modes: Optional[str] = None,
+    digits: int = HEX_DIGITS - 1,
+    n_frames: Optional[int] = None,
+) -> int:
+    # Writes an iterable of (n, 129) row blocks; .npy output needs n_frames
+    # up front (the arrays are opened as memmaps). Returns the row count.
+    fmt = vector_format(path)
+    if not HEX_DIGITS - 1 <= digits <= HEX_DIGITS:
+        raise ValueError(f"digits must be {HEX_DIGITS - 1} or {HEX_DIGITS}")
+    n = 0
+    if fmt == "npy":
+        if n_frames is None:
+            raise ValueError("n_frames is required for .npy output")
+        lanes = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.int16, shape=(n_frames, 64)
+        )
+        hdr = np.lib.format.open_memmap(
+            modes or modes_path(path), mode="w+", dtype=np.uint8, shape=(n_frames,)
+        )
+        for blk in blocks:
+            if n + blk.shape[0] > n_frames:
+                raise ValueError(f"more than n_frames={n_frames} rows")
+            lanes[n : n + blk.shape[0]], hdr[n : n + blk.shape[0]] = split_frames(blk)
+            n += blk.shape[0]
+        if n != n_frames:
+            raise ValueError(f"expected {n_frames} rows, got {n}")
+        lanes.flush()
+        hdr.flush()
+        return n
+
+    with open(path, "wb") as f:
+        if fmt == "coe":
+            f.write(b"memory_initialization_radix = 16;\n")
+            f.write(b"memory_initialization_vector =")
+        for blk in blocks:
+            blk = np.asarray(blk, dtype=np.uint8)
+            if fmt == "bin":
+                f.write(blk.tobytes())
+            elif fmt == "hex":
+                f.write(_hex_lines(blk, digits))
+            else:
+                # Previous row's separator goes first so the last ends in ';'.
+                lines = _hex_lines(blk, digits).replace(b"\n", b",\n    ")
+                f.write((b",\n    " if n else b"\n    ") + lines[: -len(b",\n    ")])
+            n += blk.shape[0]
+        if fmt == "coe":
+            f.write(b";\n")
+    return n
+
+
+def convert(
+    src: str,
+    dst: str,
+    *,
+    src_modes: Optional[str] = None,
+    dst_modes: Optional[str] = None,
+    digits: int = HEX_DIGITS - 1,
+    block_rows: int = BLOCK_ROWS,
+) -> int:
+    n_frames = None
+    if vector_format(dst) == "npy":
+        n_frames = count_frames(src, block_rows=block_rows)
+    blocks = iter_frames(src, modes=src_modes, block_rows=block_rows)
+    return write_frames(dst, blocks, modes=dst_modes, digits=digits, n_frames=n_frames)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert .hex/.coe/.bin/.npy vectors.")
+    ap.add_argument("src")
+    ap.add_argument("dst")
+    ap.add_argument("--src-modes", help="modes for .npy input (<src>_modes.npy)")
+    ap.add_argument("--dst-modes", help="modes for .npy output (<dst>_modes.npy)")
+    ap.add_argument(
+        "--digits", type=int, default=HEX_DIGITS - 1, help="hex digits per row"
+    )
+    args = ap.parse_args()
+    n = convert(
+        args.src,
+        args.dst,
+        src_modes=args.src_modes,
+        dst_modes=args.dst_modes,
+        digits=args.digits,
+    )
+    print(f"{n} rows -> {args.dst}")
+
+
+if __name__ == "__main__":
+    main()
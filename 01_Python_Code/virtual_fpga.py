@@ -0,0 +1,194 @@
+import os
+import select
+import sys
+import threading
+import time
+import tty
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from softmax_batch import BITS_PER_BYTE, BYTES_PER_ROW
+from softmax_emulator import EmulatedDevice
+
+
+@dataclass
+class FaultProfile:
+    # Per-byte rates apply to every byte on the line (drop: both directions,
+    # dup: device TX only); per-transaction rates are drawn once per request.
+    # A stuck controller stops after a random part of its reply, ignores
+    # the RX line for stuck_s and then returns to idle, as a watchdog reset
+    # would.
+    drop_rate: float = 0.0
+    dup_rate: float = 0.0
+    delay_rate: float = 0.0
+    delay_s: float = 0.0
+    stuck_rate: float = 0.0
+    stuck_s: float = 0.0
+
+
+class VirtualFPGA:
+    # Pseudo-terminal stand-in for the board. It follows the host-visible
+    # side of uart_bram_controller: a depth byte, (depth + 1) rows of 129
+    # bytes in, then the same number of 129-byte result rows out, computed
+    # with the bit-exact emulator. Bytes are paced at 10 bits per byte of
+    # the configured baud in both directions; compute_delay_s is added
+    # between the last RX byte and the first TX byte. faults injects line
+    # and controller faults (FaultProfile) from a seeded generator.
+
+    def __init__(
+        self,
+        *,
+        baud: int = 115200,
+        compute_delay_s: float = 0.0,
+        pace: bool = True,
+        faults: Optional[FaultProfile] = None,
+        seed: int = 0,
+    ):
+        self.baud = baud
+        self.compute_delay_s = compute_delay_s
+        self.pace = pace
+        self.faults = faults or FaultProfile()
+        self._rng = np.random.default_rng(seed)
+
+        self.stats = {
+            "transactions": 0,
+            "rows": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "dropped": 0,
+            "duplicated": 0,
+            "delayed": 0,
+            "stuck": 0,
+        }
+        self._device = EmulatedDevice()
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def byte_time_s(self) -> float:
+        return BITS_PER_BYTE / self.baud if self.pace else 0.0
+
+    def start(self) -> "VirtualFPGA":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, n: int) -> bytes:
+        # Returns fewer than n bytes only when stopped.
+        buf = bytearray()
+        while len(buf) < n:
+            if self._stop.is_set():
+                break
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if ready:
+                buf.extend(self._rx_faults(os.read(self._master, n - len(buf))))
+        return bytes(buf)
+
+    def _rx_faults(self, data: bytes) -> bytes:
+        if not self.faults.drop_rate:
+            return data
+        keep = self._rng.random(len(data)) >= self.faults.drop_rate
+        self.stats["dropped"] += int((~keep).sum())
+        return np.frombuffer(data, dtype=np.uint8)[keep].tobytes()
+
+    def _tx_faults(self, data: bytes) -> bytes:
+        f = self.faults
+        if not (f.drop_rate or f.dup_rate):
+            return data
+        drop = self._rng.random(len(data)) < f.drop_rate
+        dup = self._rng.random(len(data)) < f.dup_rate
+        counts = np.where(drop, 0, 1 + dup)
+        self.stats["dropped"] += int(drop.sum())
+        self.stats["duplicated"] += int((dup & ~drop).sum())
+        return np.repeat(np.frombuffer(data, dtype=np.uint8), counts).tobytes()
+
+    def _discard_input(self) -> None:
+        while select.select([self._master], [], [], 0)[0]:
+            if not os.read(self._master, 4096):
+                return
+
+    def _write_paced(self, data: bytes) -> None:
+        # Hands bytes to the pty no earlier than the UART would shift them
+        # out, in slices of about 2 ms.
+        bt = self.byte_time_s
+        step = max(1, int(0.002 / bt)) if bt else len(data)
+        t0 = time.perf_counter()
+        for off in range(0, len(data), step):
+            due = t0 + off * bt
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            os.write(self._master, data[off : off + step])
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            head = self._read(1)
+            if not head:
+                return
+            t0 = time.perf_counter()
+            n_rows = head[0] + 1
+            body = self._read(n_rows * BYTES_PER_ROW)
+            if len(body) < n_rows * BYTES_PER_ROW:
+                return
+
+            # The host may write faster than the wire; hold the reply until
+            # the request would have finished arriving.
+            rx_done = t0 + len(body) * self.byte_time_s
+            frames = np.frombuffer(body, dtype=np.uint8).reshape(n_rows, BYTES_PER_ROW)
+            out = self._device.transact(frames)
+            wait = rx_done + self.compute_delay_s - time.perf_counter()
+            f = self.faults
+            if f.delay_rate and self._rng.random() < f.delay_rate:
+                wait += f.delay_s
+                self.stats["delayed"] += 1
+            if wait > 0:
+                self._stop.wait(wait)
+
+            tx = self._tx_faults(out.tobytes())
+            if f.stuck_rate and self._rng.random() < f.stuck_rate:
+                self._write_paced(tx[: int(self._rng.integers(0, len(tx)))])
+                self._stop.wait(f.stuck_s)
+                self._discard_input()
+                self.stats["stuck"] += 1
+            else:
+                self._write_paced(tx)
+
+            st = self.stats
+            st["transactions"] += 1
+            st["rows"] += n_rows
+            st["bytes_in"] += 1 + len(body)
+            st["bytes_out"] += out.size
+
+
+if __name__ == "__main__":
+    baud = int(sys.argv[1]) if len(sys.argv) > 1 else 115200
+    with VirtualFPGA(baud=baud) as dev:
+        print(f"Virtual FPGA on {dev.port} ({baud} baud). Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass